@@ -14,14 +14,29 @@ import logging
 import asyncio
 import aiohttp
 import base64
+import cProfile
+import hashlib
+import heapq
 import io
-from datetime import datetime
+import itertools
+import math
+import random
+import shutil
+import tarfile
+import tempfile
+import threading
+import tracemalloc
+import uuid
+import zipfile
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Any
-from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
 import requests
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, features
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -37,6 +52,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@dataclass
+class ShopTarget:
+    """A Shopify store to upload rendered images to"""
+    shop_domain: str
+    shop_admin_token: Optional[str] = None
+    shopify_api_key: Optional[str] = None
+    shopify_password: Optional[str] = None
+
 @dataclass
 class ProcessingConfig:
     """Configuration for image processing"""
@@ -56,6 +79,28 @@ class ProcessingConfig:
     watermark_img_path: Optional[str] = None
     watermark_opacity: float = 0.12
     watermark_scale: float = 0.35
+    mirror_sources: bool = True
+    source_cache_dir: Optional[str] = None
+    per_host_concurrency: int = 4
+    archive_path: Optional[str] = None
+    save_cutouts: bool = True
+    cutout_dir: Optional[str] = None
+    shops: List[ShopTarget] = field(default_factory=list)
+    shopify_requests_per_second: float = 2.0
+    sync_since: Optional[str] = None
+    sync_bulk: bool = False
+    sync_replace_strategy: str = "append"
+
+    def shop_targets(self) -> List[ShopTarget]:
+        """Stores to upload to; falls back to the single SHOP_DOMAIN settings"""
+        if self.shops:
+            return self.shops
+        return [ShopTarget(
+            shop_domain=self.shop_domain,
+            shop_admin_token=self.shop_admin_token,
+            shopify_api_key=self.shopify_api_key,
+            shopify_password=self.shopify_password
+        )]
 
 @dataclass
 class ImageRow:
@@ -77,118 +122,501 @@ class ImageRow:
     is_featured: bool = False
     variant_sku: Optional[str] = None
 
+@dataclass
+class ShopUpload:
+    """Upload progress for one row on one shop"""
+    product_id: Optional[str] = None
+    image_id: Optional[str] = None
+    uploaded_at: Optional[str] = None
+    completed_steps: set = field(default_factory=set)
+    done: bool = False
+    error: Optional[str] = None
+
+@dataclass
+class RowJob:
+    """A row moving through the pipeline, with enough state to resume after a retry"""
+    row: ImageRow
+    attempts: int = 0
+    source: Optional[bytes] = None
+    cutout: Optional[bytes] = None
+    processed: Optional[bytes] = None
+    uploads: Dict[str, ShopUpload] = field(default_factory=dict)
+
+    def pending_uploads(self) -> Dict[str, ShopUpload]:
+        return {domain: upload for domain, upload in self.uploads.items() if not upload.done and not upload.error}
+
+def load_rows(csv_path: str, limit: Optional[int] = None) -> List[ImageRow]:
+    """Load and parse CSV file"""
+    rows = []
+    with open(csv_path, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        for i, row_data in enumerate(reader):
+            if limit and i >= limit:
+                break
+
+            row = ImageRow(
+                sku=row_data.get('sku', ''),
+                image_url=row_data.get('image_url') or None,
+                image_path=row_data.get('image_path') or None,
+                handle=row_data.get('handle') or None,
+                product_id=row_data.get('product_id') or None,
+                overlay_text=row_data.get('overlay_text') or None,
+                overlay_logo_path=row_data.get('overlay_logo_path') or None,
+                bg_color=row_data.get('bg_color') or None,
+                target=int(row_data.get('target', 0)) or None,
+                text_position=row_data.get('text_position', 'bottom-left'),
+                watermark_img=row_data.get('watermark_img') or None,
+                watermark_opacity=float(row_data.get('watermark_opacity', 0)) or None,
+                replace_strategy=row_data.get('replace_strategy', 'append'),
+                alt_text=row_data.get('alt_text') or None,
+                is_featured=row_data.get('is_featured', '').lower() == 'true',
+                variant_sku=row_data.get('variant_sku') or None
+            )
+            rows.append(row)
+
+    return rows
+
+def atomic_write(path: Path, data: bytes):
+    """Write bytes via temp file + rename so readers never see a partial file"""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+class RetryableError(Exception):
+    """Transient upstream failure; the row goes back on the retry queue instead of sleeping in its slot"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class UpstreamUnavailable(RetryableError):
+    """Upstream is paused (open circuit or rate limit); does not count against the row's retry budget"""
+
+def retry_delay(attempt: int, retry_after: Optional[float] = None,
+                base: float = 5.0, cap: float = 300.0) -> float:
+    """Jittered delay before the next attempt, never earlier than the upstream asked for"""
+    if retry_after is not None:
+        return retry_after + random.uniform(0, 1 + retry_after * 0.1)
+    backoff = min(cap, base * (2 ** max(attempt - 1, 0)))
+    return random.uniform(backoff / 2, backoff)
+
+class CircuitBreaker:
+    """Pauses dispatch to an upstream on sustained 5xx/timeouts and probes before resuming
+
+    Thread-safe: Shopify clients drive their breaker from several executor threads.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, cooldown: float = 30.0, max_cooldown: float = 300.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = 'closed'
+        self.failures = 0
+        self._cooldown = cooldown
+        self._opened_until = 0.0
+        self._paused_until = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_request(self) -> bool:
+        """Raise UpstreamUnavailable unless a request may be dispatched now
+
+        Returns True when this request is the half-open probe; the caller must
+        then call release_probe() once the request is over, whatever the outcome.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                raise UpstreamUnavailable(f"{self.name} rate limited", retry_after=self._paused_until - now)
+
+            if self.state == 'open':
+                if now < self._opened_until:
+                    raise UpstreamUnavailable(f"{self.name} circuit open", retry_after=self._opened_until - now)
+                self.state = 'half_open'
+                logger.info(f"🔌 {self.name} circuit half-open, probing")
+
+            if self.state == 'half_open':
+                if self._probe_in_flight:
+                    raise UpstreamUnavailable(f"{self.name} probe in flight", retry_after=1.0)
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def release_probe(self):
+        """Free the probe slot; only the request that got True from before_request() calls this"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        """Upstream answered (any non-5xx response)"""
+        with self._lock:
+            if self.state != 'closed':
+                logger.info(f"🔌 {self.name} circuit closed, resuming dispatch")
+            self.state = 'closed'
+            self.failures = 0
+            self._cooldown = self.base_cooldown
+
+    def record_failure(self):
+        """Upstream returned 5xx or timed out"""
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open':
+                self._cooldown = min(self._cooldown * 2, self.max_cooldown)
+                self._open()
+            elif self.state == 'closed' and self.failures >= self.failure_threshold:
+                self._open()
+
+    def pause(self, seconds: float):
+        """Hold dispatch for a while without treating the upstream as failing (rate limits)"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + max(seconds, 0.0))
+
+    def _open(self):
+        self.state = 'open'
+        self._opened_until = time.monotonic() + self._cooldown
+        logger.warning(f"🔌 {self.name} circuit open for {self._cooldown:.0f}s after {self.failures} failures")
+
+class RateLimiter:
+    """Thread-safe token bucket; acquire() blocks the calling thread until a request may go out"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Reserve a token even when the bucket is empty; the deficit is our wait
+            self._tokens -= 1
+            wait_time = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+class RetryQueue:
+    """Delayed retry queue: jobs wait for their deadline here, not in a worker slot"""
+
+    def __init__(self, ready: asyncio.Queue):
+        self._ready = ready
+        self._heap: List[Tuple[float, int, Any]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def schedule(self, job: Any, delay: float):
+        deadline = asyncio.get_running_loop().time() + delay
+        heapq.heappush(self._heap, (deadline, next(self._seq), job))
+        self._wakeup.set()
+
+    async def run(self):
+        """Move jobs to the ready queue as their deadlines pass; runs until cancelled"""
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, job = heapq.heappop(self._heap)
+                self._ready.put_nowait(job)
+            timeout = self._heap[0][0] - now if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+class SourceMirror:
+    """On-disk mirror of source images keyed by URL, revalidated with conditional GETs"""
+
+    def __init__(self, cache_dir: Path, per_host_concurrency: int = 4):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.per_host_concurrency = per_host_concurrency
+        self.stats = {'downloaded': 0, 'not_modified': 0, 'stale': 0}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _paths(self, url: str) -> Tuple[Path, Path]:
+        """Return (data, metadata) paths for a URL"""
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return self.cache_dir / f"{key}.bin", self.cache_dir / f"{key}.json"
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Shared pooled session, created lazily inside the running loop"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit_per_host=self.per_host_concurrency)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=60)
+            )
+        return self._session
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlparse(url).netloc.lower()
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.per_host_concurrency)
+        return self._host_semaphores[host]
+
+    def get_metadata(self, url: str) -> Optional[Dict]:
+        """Return stored metadata (etag, last_modified, sha256, ...) for a mirrored URL"""
+        data_path, meta_path = self._paths(url)
+        if not (data_path.exists() and meta_path.exists()):
+            return None
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, url: str, data: bytes, headers) -> Dict:
+        data_path, meta_path = self._paths(url)
+        meta = {
+            'url': url,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'content_type': headers.get('Content-Type'),
+            'sha256': hashlib.sha256(data).hexdigest(),
+            'size': len(data),
+            'fetched_at': datetime.now().isoformat()
+        }
+        atomic_write(data_path, data)
+        atomic_write(meta_path, json.dumps(meta, indent=2).encode('utf-8'))
+        return meta
+
+    def _read_cached(self, url: str) -> bytes:
+        data_path, _ = self._paths(url)
+        with open(data_path, 'rb') as f:
+            return f.read()
+
+    async def fetch(self, url: str) -> bytes:
+        """Return source bytes, downloading only when the origin copy has changed"""
+        meta = await asyncio.to_thread(self.get_metadata, url)
+
+        headers = {}
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        session = self._get_session()
+        async with self._host_semaphore(url):
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 304 and meta:
+                        self.stats['not_modified'] += 1
+                        return await asyncio.to_thread(self._read_cached, url)
+                    if response.status == 200:
+                        data = await response.read()
+                        await asyncio.to_thread(self._store, url, data, response.headers)
+                        self.stats['downloaded'] += 1
+                        return data
+                    if response.status != 429 and response.status < 500:
+                        raise Exception(f"Source fetch error {response.status}: {url}")
+                    retry_after = response.headers.get('Retry-After')
+                    error = RetryableError(
+                        f"Source fetch error {response.status}: {url}",
+                        retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None
+                    )
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = RetryableError(f"Source fetch failed: {url}: {e}")
+
+        if meta:
+            # Origin is unavailable; the mirrored copy is better than nothing
+            logger.warning(f"⚠️ {error}, using mirrored copy")
+            self.stats['stale'] += 1
+            return await asyncio.to_thread(self._read_cached, url)
+        raise error
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+
 class RemoveBgClient:
-    """Client for Remove.bg API with retry logic"""
+    """Client for Remove.bg API with circuit breaker and rate limit tracking"""
     
-    def __init__(self, api_key: str, max_retries: int = 5):
+    def __init__(self, api_key: str):
         self.api_key = api_key
-        self.max_retries = max_retries
         self.base_url = "https://api.remove.bg/v1.0"
+        self.breaker = CircuitBreaker('remove.bg')
     
-    async def remove_background(self, image_url: str = None, image_path: str = None) -> bytes:
-        """Remove background from image with exponential backoff retry"""
-        if not image_url and not image_path:
-            raise ValueError("Either image_url or image_path must be provided")
-        
+    def _track_rate_limit(self, headers):
+        """Pause dispatch once the X-RateLimit-* budget is spent"""
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        # Malformed headers are ignored: on a 200 the cutout is already billed
+        if remaining and reset and remaining.isdigit() and reset.isdigit() and int(remaining) <= 0:
+            self.breaker.pause(float(reset) - time.time())
+    
+    async def remove_background(self, image_url: str = None, image_path: str = None,
+                                image_data: bytes = None) -> bytes:
+        """Remove background from image; transient failures raise RetryableError"""
+        if not image_url and not image_path and image_data is None:
+            raise ValueError("Either image_url, image_path or image_data must be provided")
+
         headers = {
             'X-Api-Key': self.api_key,
             'Content-Type': 'application/json'
         }
-        
+
         data = {}
-        if image_url:
+        if image_data is not None:
+            data['image_file_b64'] = base64.b64encode(image_data).decode('utf-8')
+        elif image_url:
             data['image_url'] = image_url
         elif image_path:
             with open(image_path, 'rb') as f:
                 image_data = base64.b64encode(f.read()).decode('utf-8')
                 data['image_file_b64'] = image_data
         
-        for attempt in range(self.max_retries):
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        f"{self.base_url}/removebg",
-                        headers=headers,
-                        json=data,
-                        timeout=aiohttp.ClientTimeout(total=60)
-                    ) as response:
-                        if response.status == 200:
-                            return await response.read()
-                        elif response.status == 429:
-                            retry_after = int(response.headers.get('Retry-After', 60))
-                            wait_time = min(retry_after * (2 ** attempt), 300)
-                            logger.warning(f"⚠️ Rate limited, retrying in {wait_time}s (attempt {attempt + 1})")
-                            await asyncio.sleep(wait_time)
-                            continue
-                        elif response.status >= 500:
-                            wait_time = min(60 * (2 ** attempt), 300)
-                            logger.warning(f"⚠️ Server error {response.status}, retrying in {wait_time}s (attempt {attempt + 1})")
-                            await asyncio.sleep(wait_time)
-                            continue
+        is_probe = self.breaker.before_request()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(
+                    f"{self.base_url}/removebg",
+                    headers=headers,
+                    json=data,
+                    timeout=aiohttp.ClientTimeout(total=60)
+                ) as response:
+                    if response.status >= 500:
+                        self.breaker.record_failure()
+                        raise RetryableError(f"Remove.bg server error {response.status}")
+                    
+                    self.breaker.record_success()
+                    self._track_rate_limit(response.headers)
+                    
+                    if response.status == 200:
+                        return await response.read()
+                    elif response.status == 429:
+                        retry_after = response.headers.get('Retry-After')
+                        reset = response.headers.get('X-RateLimit-Reset')
+                        if retry_after and retry_after.isdigit():
+                            wait_time = float(retry_after)
+                        elif reset and reset.isdigit():
+                            wait_time = max(float(reset) - time.time(), 1.0)
                         else:
-                            error_text = await response.text()
-                            raise Exception(f"Remove.bg API error {response.status}: {error_text}")
-            
-            except Exception as e:
-                if attempt == self.max_retries - 1:
-                    raise e
-                wait_time = min(60 * (2 ** attempt), 300)
-                logger.warning(f"⚠️ Request failed, retrying in {wait_time}s: {e}")
-                await asyncio.sleep(wait_time)
+                            wait_time = 60.0
+                        self.breaker.pause(wait_time)
+                        raise RetryableError("Remove.bg rate limited", retry_after=wait_time)
+                    else:
+                        error_text = await response.text()
+                        raise Exception(f"Remove.bg API error {response.status}: {error_text}")
         
-        raise Exception("Max retries exceeded")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.breaker.record_failure()
+            raise RetryableError(f"Remove.bg request failed: {e}") from e
+        finally:
+            if is_probe:
+                self.breaker.release_probe()
 
 class ShopifyClient:
     """Client for Shopify API with Admin Access Token support"""
     
-    def __init__(self, config: ProcessingConfig):
+    def __init__(self, config: ProcessingConfig, shop: Optional[ShopTarget] = None):
         self.config = config
-        self.base_url = f"https://{config.shop_domain}/admin/api/2023-10"
+        self.shop = shop or config.shop_targets()[0]
+        self.shop_domain = self.shop.shop_domain
+        self.base_url = f"https://{self.shop_domain}/admin/api/2023-10"
         self.session = requests.Session()
+        self.breaker = CircuitBreaker(f"shopify:{self.shop_domain}")
+        # REST leaky bucket: 40 request burst, drained at the plan's rate
+        self.rate_limiter = RateLimiter(config.shopify_requests_per_second, burst=40)
+        # Blocking calls (and rate limit waits) run on this shop's own threads, so
+        # they never hold up the shared executor used for disk and image work
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(config.default_concurrency, 1),
+            thread_name_prefix=f"shopify-{self.shop_domain}"
+        )
         
         # Set up authentication
-        if config.shop_admin_token:
+        if self.shop.shop_admin_token:
             self.session.headers.update({
-                'X-Shopify-Access-Token': config.shop_admin_token,
+                'X-Shopify-Access-Token': self.shop.shop_admin_token,
                 'Content-Type': 'application/json'
             })
-        elif config.shopify_api_key and config.shopify_password:
-            self.session.auth = (config.shopify_api_key, config.shopify_password)
+        elif self.shop.shopify_api_key and self.shop.shopify_password:
+            self.session.auth = (self.shop.shopify_api_key, self.shop.shopify_password)
         else:
             raise ValueError("Either SHOP_ADMIN_TOKEN or SHOPIFY_API_KEY/PASSWORD must be provided")
     
     def _make_request(self, method: str, endpoint: str, **kwargs) -> requests.Response:
-        """Make API request with retry logic"""
+        """Make a single API request; transient failures raise RetryableError"""
         url = f"{self.base_url}/{endpoint}"
+        kwargs.setdefault('timeout', 60)
         
-        for attempt in range(self.config.max_retries):
+        is_probe = self.breaker.before_request()
+        try:
+            self.rate_limiter.acquire()
             try:
                 response = self.session.request(method, url, **kwargs)
-                
-                if response.status_code == 200 or response.status_code == 201:
-                    return response
-                elif response.status_code == 429:
-                    retry_after = int(response.headers.get('Retry-After', 60))
-                    wait_time = min(retry_after * (2 ** attempt), 300)
-                    logger.warning(f"⚠️ Shopify rate limited, retrying in {wait_time}s (attempt {attempt + 1})")
-                    time.sleep(wait_time)
-                    continue
-                elif response.status_code >= 500:
-                    wait_time = min(60 * (2 ** attempt), 300)
-                    logger.warning(f"⚠️ Shopify server error {response.status_code}, retrying in {wait_time}s (attempt {attempt + 1})")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    response.raise_for_status()
-                    
-            except Exception as e:
-                if attempt == self.config.max_retries - 1:
-                    raise e
-                wait_time = min(60 * (2 ** attempt), 300)
-                logger.warning(f"⚠️ Shopify request failed, retrying in {wait_time}s: {e}")
-                time.sleep(wait_time)
+            except requests.RequestException as e:
+                # Connection resets, timeouts, truncated bodies (ChunkedEncodingError), ...
+                self.breaker.record_failure()
+                raise RetryableError(f"Shopify request failed: {e}") from e
+            
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+                raise RetryableError(f"Shopify server error {response.status_code}")
+            
+            self.breaker.record_success()
+        finally:
+            if is_probe:
+                self.breaker.release_probe()
+        
+        self._track_call_limit(response.headers)
         
-        raise Exception("Max retries exceeded")
+        if response.status_code == 429:
+            retry_after = float(response.headers.get('Retry-After', 2))
+            self.breaker.pause(retry_after)
+            raise RetryableError("Shopify rate limited", retry_after=retry_after)
+        
+        response.raise_for_status()
+        return response
+    
+    async def run(self, func, *args):
+        """Run a blocking client call on this shop's executor"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+    
+    def close(self):
+        self.executor.shutdown(wait=False)
+    
+    def graphql(self, query: str, variables: Optional[Dict] = None) -> Dict:
+        """Run an Admin GraphQL query; throttling raises RetryableError"""
+        response = self._make_request('POST', 'graphql.json', json={'query': query, 'variables': variables or {}})
+        payload = response.json()
+        errors = payload.get('errors')
+        if errors:
+            if isinstance(errors, list) and any(e.get('extensions', {}).get('code') == 'THROTTLED' for e in errors):
+                cost = payload.get('extensions', {}).get('cost', {})
+                throttle = cost.get('throttleStatus', {})
+                deficit = cost.get('requestedQueryCost', 0) - throttle.get('currentlyAvailable', 0)
+                retry_after = max(deficit / (throttle.get('restoreRate') or 50), 1.0)
+                self.breaker.pause(retry_after)
+                raise RetryableError("Shopify GraphQL throttled", retry_after=retry_after)
+            raise Exception(f"Shopify GraphQL error: {errors}")
+        return payload['data']
+    
+    def _track_call_limit(self, headers):
+        """Back off briefly when the REST leaky bucket is nearly full"""
+        call_limit = headers.get('X-Shopify-Shop-Api-Call-Limit')
+        if not call_limit:
+            return
+        used, _, limit = call_limit.partition('/')
+        if used.isdigit() and limit.isdigit() and int(used) >= int(limit) - 1:
+            # The bucket leaks at 2 requests/second
+            self.breaker.pause(1.0)
     
     def get_product_by_id(self, product_id: str) -> Dict:
         """Get product by ID"""
@@ -281,63 +709,420 @@ class ShopifyClient:
         
         self._make_request('POST', f'products/{product_id}/metafields.json', json=data)
 
+def parse_timestamp(value: str) -> datetime:
+    """Parse an ISO timestamp; naive values (older pipeline stamps) are taken as local time"""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.astimezone()
+
+class UploadLedger:
+    """Append-only record (uploads.jsonl) of the images this pipeline uploaded, per shop"""
+
+    def __init__(self, output_dir: Path):
+        self.path = Path(output_dir) / 'uploads.jsonl'
+        self._lock = threading.Lock()
+
+    def record(self, shop: str, product_id: str, image_id: str, created_at: Optional[str]):
+        line = json.dumps({'shop': shop, 'product_id': product_id, 'image_id': str(image_id), 'created_at': created_at})
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+    def image_ids(self, shop: str) -> set:
+        if not self.path.exists():
+            return set()
+        ids = set()
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('shop') == shop:
+                    ids.add(entry['image_id'])
+        return ids
+
+class CatalogSync:
+    """Finds products whose source images changed since their last pipeline run
+
+    Products are read from the store's Admin GraphQL API, either page by page
+    or (for large catalogs) with a bulk operation. A product is selected when it
+    has no spm_processing.last_image_pipeline_at stamp, or when one of its images
+    was created after that stamp. Images the pipeline uploaded itself (see
+    UploadLedger) are never picked as a source.
+    """
+
+    PRODUCT_FIELDS = """
+        id
+        handle
+        metafield(namespace: "spm_processing", key: "last_image_pipeline_at") { value }
+    """
+
+    PAGE_QUERY = """
+    query CatalogSync($cursor: String, $query: String) {
+      products(first: 25, after: $cursor, query: $query) {
+        pageInfo { hasNextPage endCursor }
+        nodes {
+          %s
+          variants(first: 1) { nodes { sku } }
+          featured: media(first: 1) { nodes { ...SyncMediaImage } }
+          media(last: 20) { nodes { ...SyncMediaImage } }
+        }
+      }
+    }
+
+    fragment SyncMediaImage on MediaImage { createdAt image { id url altText } }
+    """ % PRODUCT_FIELDS
+
+    BULK_QUERY = """
+    {
+      products%s {
+        edges { node {
+          %s
+          variants { edges { node { sku } } }
+          media { edges { node { ... on MediaImage { createdAt image { id url altText } } } } }
+        } }
+      }
+    }
+    """
+
+    BULK_RUN = """
+    mutation CatalogSyncBulk($query: String!) {
+      bulkOperationRunQuery(query: $query) {
+        bulkOperation { id status }
+        userErrors { field message }
+      }
+    }
+    """
+
+    BULK_STATUS = """
+    { currentBulkOperation { id status errorCode objectCount url } }
+    """
+
+    def __init__(self, shopify: 'ShopifyClient', config: ProcessingConfig, output_dir: Path):
+        self.shopify = shopify
+        self.config = config
+        self.output_dir = output_dir
+        self.search_query = f"updated_at:>'{config.sync_since}'" if config.sync_since else None
+        self.stats = {'scanned': 0, 'selected': 0}
+        self.own_image_ids = UploadLedger(output_dir).image_ids(shopify.shop_domain)
+
+    async def _graphql(self, query: str, variables: Optional[Dict] = None) -> Dict:
+        """Run a query off-loop, waiting out throttling and transient errors"""
+        attempts = 0
+        while True:
+            try:
+                return await self.shopify.run(self.shopify.graphql, query, variables)
+            except RetryableError as e:
+                if not isinstance(e, UpstreamUnavailable):
+                    attempts += 1
+                if attempts >= self.config.max_retries:
+                    raise
+                delay = retry_delay(attempts, e.retry_after)
+                log = logger.debug if isinstance(e, UpstreamUnavailable) else logger.warning
+                log(f"⚠️ Catalog sync: {e}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def iter_rows(self) -> AsyncIterator[ImageRow]:
+        """Yield a work item for every product that needs processing"""
+        products = self._bulk_products() if self.config.sync_bulk else self._paged_products()
+        async for product in products:
+            self.stats['scanned'] += 1
+            row = self._row_for_product(product)
+            if row:
+                self.stats['selected'] += 1
+                yield row
+                if self.config.limit and self.stats['selected'] >= self.config.limit:
+                    break
+        logger.info(f"🔎 Catalog sync: {self.stats['selected']} of {self.stats['scanned']} products need processing")
+
+    async def _paged_products(self) -> AsyncIterator[Dict]:
+        cursor = None
+        while True:
+            data = await self._graphql(self.PAGE_QUERY, {'cursor': cursor, 'query': self.search_query})
+            page = data['products']
+            for product in page['nodes']:
+                yield product
+            if not page['pageInfo']['hasNextPage']:
+                return
+            cursor = page['pageInfo']['endCursor']
+
+    async def _bulk_products(self) -> AsyncIterator[Dict]:
+        search = f"(query: {json.dumps(self.search_query)})" if self.search_query else ''
+        data = await self._graphql(self.BULK_RUN, {'query': self.BULK_QUERY % (search, self.PRODUCT_FIELDS)})
+        user_errors = data['bulkOperationRunQuery']['userErrors']
+        if user_errors:
+            raise Exception(f"Bulk operation rejected: {user_errors}")
+        logger.info(f"📦 Bulk operation started: {data['bulkOperationRunQuery']['bulkOperation']['id']}")
+
+        while True:
+            await asyncio.sleep(5)
+            operation = (await self._graphql(self.BULK_STATUS))['currentBulkOperation']
+            if operation['status'] == 'COMPLETED':
+                break
+            if operation['status'] in ('FAILED', 'CANCELED', 'EXPIRED'):
+                raise Exception(f"Bulk operation {operation['status'].lower()}: {operation.get('errorCode')}")
+        logger.info(f"📦 Bulk operation complete: {operation['objectCount']} objects")
+        if not operation.get('url'):
+            return
+
+        jsonl_path = self.output_dir / 'catalog_sync.jsonl'
+        await asyncio.to_thread(self._download, operation['url'], jsonl_path)
+
+        # Child objects follow their parent product and point back via __parentId
+        product = None
+        with open(jsonl_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                node = json.loads(line)
+                parent_id = node.pop('__parentId', None)
+                if parent_id is None:
+                    if product:
+                        yield product
+                    product = dict(node, variants={'nodes': []}, media={'nodes': []})
+                elif product and parent_id == product['id']:
+                    key = 'media' if 'createdAt' in node or not node else 'variants'
+                    product[key]['nodes'].append(node)
+        if product:
+            yield product
+
+    @staticmethod
+    def _download(url: str, path: Path):
+        with requests.get(url, stream=True, timeout=300) as response:
+            response.raise_for_status()
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+
+    def _is_own_upload(self, media: Dict) -> bool:
+        image_id = media['image'].get('id') or ''
+        return image_id.rsplit('/', 1)[-1] in self.own_image_ids
+
+    @staticmethod
+    def _created_at(media: Dict) -> Optional[datetime]:
+        try:
+            return parse_timestamp(media['createdAt'])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def _row_for_product(self, product: Dict) -> Optional[ImageRow]:
+        # Paged queries fetch the featured image separately from the newest media
+        nodes = (product.get('featured') or {'nodes': []})['nodes'] + product['media']['nodes']
+        images = [media for media in nodes if media.get('image') and not self._is_own_upload(media)]
+        if not images:
+            return None
+
+        last_run = None
+        stamp = (product.get('metafield') or {}).get('value')
+        if stamp:
+            try:
+                last_run = parse_timestamp(stamp)
+            except ValueError:
+                logger.warning(f"⚠️ Catalog sync: ignoring malformed stamp {stamp!r} on {product['handle']}")
+
+        if last_run:
+            dated = [(self._created_at(media), media) for media in images]
+            changed = [(created_at, media) for created_at, media in dated if created_at and created_at > last_run]
+            if not changed:
+                return None
+            source = max(changed, key=lambda item: item[0])[1]
+        else:
+            # Never processed: start from the featured image
+            source = images[0]
+
+        variants = product['variants']['nodes']
+        return ImageRow(
+            sku=(variants[0].get('sku') if variants else None) or product['handle'],
+            image_url=source['image']['url'],
+            handle=product['handle'],
+            product_id=product['id'].rsplit('/', 1)[-1],
+            alt_text=source['image'].get('altText') or None,
+            replace_strategy=self.config.sync_replace_strategy
+        )
+
+CUTOUT_METADATA_TAG = 0x010E  # EXIF ImageDescription
+WEBP_MAX_DIMENSION = 16383
+
+@dataclass
+class Cutout:
+    """Foreground cropped to its alpha bounding box, plus where it sat in the original frame"""
+    image: Image.Image
+    offset: Tuple[int, int]
+    frame_size: Tuple[int, int]
+
+def decode_cutout(image_data: bytes) -> Cutout:
+    """Load a compact cutout, or crop a full-frame cutout (legacy PNGs, render-only dirs) on the fly"""
+    image = Image.open(io.BytesIO(image_data))
+    meta = None
+    description = image.getexif().get(CUTOUT_METADATA_TAG)
+    if description:
+        try:
+            meta = json.loads(description).get('spm_cutout')
+        except (ValueError, AttributeError):
+            meta = None
+
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+
+    if meta:
+        return Cutout(image, tuple(meta['offset']), tuple(meta['frame_size']))
+
+    # Fully transparent frames keep a single pixel so the geometry stays valid
+    bbox = image.getchannel('A').getbbox() or (0, 0, 1, 1)
+    return Cutout(image.crop(bbox), (bbox[0], bbox[1]), image.size)
+
+def encode_cutout(cutout: Cutout) -> bytes:
+    """Encode a cutout as lossless WebP (PNG when WebP is unavailable or too large)"""
+    exif = Image.Exif()
+    exif[CUTOUT_METADATA_TAG] = json.dumps({'spm_cutout': {
+        'offset': list(cutout.offset),
+        'frame_size': list(cutout.frame_size)
+    }})
+    output = io.BytesIO()
+    if features.check('webp') and max(cutout.image.size) <= WEBP_MAX_DIMENSION:
+        cutout.image.save(output, format='WEBP', lossless=True, exif=exif)
+    else:
+        cutout.image.save(output, format='PNG', exif=exif)
+    return output.getvalue()
+
+def compact_cutout(image_data: bytes) -> bytes:
+    """Normalize a full-frame Remove.bg result into the compact cropped intermediate"""
+    return encode_cutout(decode_cutout(image_data))
+
+def cutout_suffix(data: bytes) -> str:
+    return '.webp' if data[:4] == b'RIFF' and data[8:12] == b'WEBP' else '.png'
+
+class StageProfiler:
+    """Collects per-stage cProfile data and wall-clock timings for ImageProcessor"""
+
+    def __init__(self):
+        self.profiles: Dict[str, cProfile.Profile] = {}
+        self.timings: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        profile = self.profiles.setdefault(name, cProfile.Profile())
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def dump(self, profile_dir: Path):
+        """Write one pstats file per stage"""
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        for name, profile in self.profiles.items():
+            profile.dump_stats(str(profile_dir / f"{name}.pstats"))
+        logger.info(f"📈 Stage profiles saved to {profile_dir}")
+
+    def log_summary(self):
+        for name, total in sorted(self.timings.items(), key=lambda item: item[1], reverse=True):
+            calls = self.calls[name]
+            logger.info(f"⏱️ {name}: {total:.3f}s over {calls} calls ({total / calls * 1000:.1f}ms avg)")
+
 class ImageProcessor:
     """Handles image processing with Pillow"""
     
     def __init__(self, config: ProcessingConfig):
         self.config = config
+        self.profiler: Optional['StageProfiler'] = None
+    
+    def _stage(self, name: str):
+        """Profile a processing stage when a profiler is attached"""
+        return self.profiler.stage(name) if self.profiler else nullcontext()
     
     def process_image(self, image_data: bytes, row: ImageRow) -> bytes:
         """Process image with background removal, resizing, overlays, and watermark"""
-        # Load image
-        image = Image.open(io.BytesIO(image_data))
-        
-        # Convert to RGBA if not already
-        if image.mode != 'RGBA':
-            image = image.convert('RGBA')
+        with self._stage('decode'):
+            # Load the cropped cutout
+            cutout = decode_cutout(image_data)
         
         # Get target size
         target_size = row.target or self.config.default_target_size
         
-        # Create square canvas with background color
-        bg_color = row.bg_color or self.config.default_bg_color
-        canvas = Image.new('RGBA', (target_size, target_size), bg_color)
-        
-        # Calculate position to center the image
-        img_width, img_height = image.size
+        # Calculate position to center the original frame
+        img_width, img_height = cutout.frame_size
         scale = min(target_size / img_width, target_size / img_height)
         new_width = int(img_width * scale)
         new_height = int(img_height * scale)
         
-        # Resize image maintaining aspect ratio
-        image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        with self._stage('resize'):
+            # Resize maintaining aspect ratio; only the foreground is resampled
+            image, (offset_x, offset_y) = self._resize_cutout(cutout, new_width, new_height)
         
-        # Center on canvas
-        x = (target_size - new_width) // 2
-        y = (target_size - new_height) // 2
-        canvas.paste(image, (x, y), image)
+        with self._stage('composite'):
+            # Create square canvas with background color
+            bg_color = row.bg_color or self.config.default_bg_color
+            canvas = Image.new('RGBA', (target_size, target_size), bg_color)
+            
+            # Center on canvas
+            x = (target_size - new_width) // 2
+            y = (target_size - new_height) // 2
+            canvas.paste(image, (x + offset_x, y + offset_y), image)
         
         # Add text overlay
         if row.overlay_text:
-            self._add_text_overlay(canvas, row.overlay_text, row.text_position)
+            with self._stage('text'):
+                self._add_text_overlay(canvas, row.overlay_text, row.text_position)
         
         # Add logo overlay
         if row.overlay_logo_path and os.path.exists(row.overlay_logo_path):
-            self._add_logo_overlay(canvas, row.overlay_logo_path)
+            with self._stage('overlay'):
+                self._add_logo_overlay(canvas, row.overlay_logo_path)
         
         # Add watermark
         watermark_img = row.watermark_img or self.config.watermark_img_path
         watermark_opacity = row.watermark_opacity or self.config.watermark_opacity
         
         if watermark_img and os.path.exists(watermark_img):
-            self._add_watermark(canvas, watermark_img, watermark_opacity)
+            with self._stage('watermark'):
+                self._add_watermark(canvas, watermark_img, watermark_opacity)
         elif self.config.watermark_text:
-            self._add_text_watermark(canvas, self.config.watermark_text, watermark_opacity)
+            with self._stage('text'):
+                self._add_text_watermark(canvas, self.config.watermark_text, watermark_opacity)
+        
+        with self._stage('encode'):
+            # Convert to PNG bytes
+            output = io.BytesIO()
+            canvas.save(output, format='PNG')
+            return output.getvalue()
+    
+    @staticmethod
+    def _resize_cutout(cutout: Cutout, new_width: int, new_height: int) -> Tuple[Image.Image, Tuple[int, int]]:
+        """Resize the cropped foreground to match a full-frame LANCZOS resize byte for byte
+        
+        Pillow resizes RGBA premultiplied, so transparent margins contribute nothing.
+        The crop is padded with transparent pixels beyond the filter's reach and the
+        padded edges are snapped to source pixels that map onto whole output pixels,
+        so the region is sampled on exactly the full-frame grid. When the scale leaves
+        no such pixels near the crop (coprime sizes), that axis falls back to the full
+        frame. Returns the region and its offset in the resized frame.
+        """
+        frame_width, frame_height = cutout.frame_size
+        left, top = cutout.offset
+        src_left, src_right, dst_left, dst_right = ImageProcessor._aligned_span(
+            left, left + cutout.image.width, frame_width, new_width)
+        src_top, src_bottom, dst_top, dst_bottom = ImageProcessor._aligned_span(
+            top, top + cutout.image.height, frame_height, new_height)
         
-        # Convert to PNG bytes
-        output = io.BytesIO()
-        canvas.save(output, format='PNG')
-        return output.getvalue()
+        padded = Image.new('RGBA', (src_right - src_left, src_bottom - src_top), (0, 0, 0, 0))
+        padded.paste(cutout.image, (left - src_left, top - src_top))
+        region = padded.resize((dst_right - dst_left, dst_bottom - dst_top), Image.Resampling.LANCZOS)
+        return region, (dst_left, dst_top)
+    
+    @staticmethod
+    def _aligned_span(start: int, end: int, frame: int, new: int) -> Tuple[int, int, int, int]:
+        """Padded source span [start, end) on one axis, snapped to the resize grid; returns (src0, src1, dst0, dst1)"""
+        # Source pixels at multiples of step land exactly on output pixel boundaries
+        step = frame // math.gcd(frame, new)
+        # Twice the LANCZOS support (3 output pixels) in source pixels, plus rounding slack
+        pad = math.ceil(6 * max(frame / new, 1.0)) + 3
+        src0 = max(start - pad, 0) // step * step
+        src1 = min(-(-(end + pad) // step) * step, frame)
+        return src0, src1, src0 * new // frame, src1 * new // frame
     
     def _add_text_overlay(self, canvas: Image.Image, text: str, position: str):
         """Add text overlay to canvas"""
@@ -432,167 +1217,442 @@ class ImageProcessor:
         alpha = int(255 * opacity)
         draw.text((x, y), text, font=font, fill=(128, 128, 128, alpha))
 
+class ArchiveSink:
+    """Streams saved outputs into a tar or zip archive for handing off to other systems"""
+
+    def __init__(self, archive_path: str):
+        self.archive_path = Path(archive_path)
+        name = self.archive_path.name.lower()
+        self._names = set()
+        if name.endswith('.zip'):
+            self._zip = zipfile.ZipFile(str(self.archive_path), 'w', compression=zipfile.ZIP_STORED)
+            self._tar = None
+        elif name.endswith(('.tar', '.tar.gz', '.tgz')):
+            mode = 'w|gz' if name.endswith(('.tar.gz', '.tgz')) else 'w|'
+            self._tar = tarfile.open(str(self.archive_path), mode)
+            self._zip = None
+        else:
+            raise ValueError(f"Unsupported archive type: {archive_path} (use .zip, .tar or .tar.gz)")
+
+    def add(self, name: str, data: bytes):
+        """Append a file to the archive, skipping names already written"""
+        if name in self._names:
+            return
+        self._names.add(name)
+        if self._zip:
+            self._zip.writestr(name, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            self._tar.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        if self._zip:
+            self._zip.close()
+        else:
+            self._tar.close()
+
+class OutputStore:
+    """Content-addressed output store with off-loop atomic writes
+
+    Each render is written once to objects/<sha256>.png. The per-SKU files
+    in the output directory ({sku}_{hash}.png) are hard links to those
+    objects, and manifest.json maps every SKU to the hashes produced for it.
+    """
+
+    def __init__(self, output_dir: Path, archive_path: Optional[str] = None):
+        self.output_dir = Path(output_dir)
+        self.objects_dir = self.output_dir / 'objects'
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.output_dir / 'manifest.json'
+        self.manifest = self._load_manifest()
+        self.archive = ArchiveSink(archive_path) if archive_path else None
+        self.stats = {'written': 0, 'deduplicated': 0}
+        self._archive_lock = asyncio.Lock()
+
+    def _load_manifest(self) -> Dict:
+        if self.manifest_path.exists():
+            try:
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"⚠️ Ignoring unreadable manifest {self.manifest_path}: {e}")
+        return {'skus': {}}
+
+    def _write(self, sku: str, digest: str, data: bytes) -> Tuple[Path, bool]:
+        """Write object and SKU link; returns (link path, whether the object was new)"""
+        object_path = self.objects_dir / f"{digest}.png"
+        is_new = not object_path.exists()
+        if is_new:
+            atomic_write(object_path, data)
+
+        link_path = self.output_dir / f"{sku}_{digest[:16]}.png"
+        if not link_path.exists():
+            tmp_path = link_path.with_name(f".{link_path.name}.{uuid.uuid4().hex}.tmp")
+            try:
+                os.link(object_path, tmp_path)
+            except OSError:
+                # Filesystem without hard link support
+                shutil.copyfile(object_path, tmp_path)
+            os.replace(tmp_path, link_path)
+        return link_path, is_new
+
+    async def save(self, sku: str, data: bytes) -> Path:
+        """Store a rendered image for a SKU and return its output path"""
+        digest = hashlib.sha256(data).hexdigest()
+        output_path, is_new = await asyncio.to_thread(self._write, sku, digest, data)
+
+        self.stats['written' if is_new else 'deduplicated'] += 1
+        entries = self.manifest['skus'].setdefault(sku, [])
+        if not any(entry['hash'] == digest for entry in entries):
+            entries.append({
+                'hash': digest,
+                'file': output_path.name,
+                'saved_at': datetime.now().isoformat()
+            })
+
+        if self.archive:
+            async with self._archive_lock:
+                await asyncio.to_thread(self.archive.add, output_path.name, data)
+
+        return output_path
+
+    async def close(self):
+        """Flush the manifest and finish the archive"""
+        payload = json.dumps(self.manifest, indent=2).encode('utf-8')
+        await asyncio.to_thread(atomic_write, self.manifest_path, payload)
+        if self.archive:
+            async with self._archive_lock:
+                await asyncio.to_thread(self.archive.close)
+
+def cutout_key(row: ImageRow) -> str:
+    """Stable name for a row's cutout, so rows sharing a SKU keep separate cutouts"""
+    source = row.image_url or row.image_path or ''
+    return f"{row.sku}_{hashlib.sha256(source.encode('utf-8')).hexdigest()[:12]}"
+
+class CutoutStore:
+    """Keeps Remove.bg cutouts on disk so renders can be replayed without the network"""
+
+    def __init__(self, cutout_dir: Path):
+        self.cutout_dir = Path(cutout_dir)
+        self.cutout_dir.mkdir(parents=True, exist_ok=True)
+
+    SUFFIXES = ('.webp', '.png')
+
+    def find(self, row: ImageRow) -> Optional[Path]:
+        """Locate a saved cutout by row key, falling back to {sku}.webp/.png"""
+        for stem in (cutout_key(row), row.sku):
+            for suffix in self.SUFFIXES:
+                path = self.cutout_dir / f"{stem}{suffix}"
+                if path.exists():
+                    return path
+        return None
+
+    async def save(self, row: ImageRow, data: bytes) -> Path:
+        path = self.cutout_dir / f"{cutout_key(row)}{cutout_suffix(data)}"
+        await asyncio.to_thread(atomic_write, path, data)
+        return path
+
+    def rows_from_directory(self, limit: Optional[int] = None) -> List[ImageRow]:
+        """Build bare rows from a directory of cutouts (compact or transparent PNGs), one per file"""
+        paths = sorted(path for path in self.cutout_dir.iterdir() if path.suffix.lower() in self.SUFFIXES)
+        rows = [ImageRow(sku=path.stem, image_path=str(path)) for path in paths]
+        return rows[:limit] if limit else rows
+
 class BulkImageProcessor:
     """Main processor class that orchestrates the entire pipeline"""
     
     def __init__(self, config: ProcessingConfig):
         self.config = config
-        self.remove_bg = RemoveBgClient(config.remove_bg_api_key, config.max_retries)
-        self.shopify = ShopifyClient(config)
+        self.remove_bg = RemoveBgClient(config.remove_bg_api_key)
+        self.shopify_clients = {
+            shop.shop_domain: ShopifyClient(config, shop) for shop in config.shop_targets()
+        }
+        self.shop_results = {domain: {'uploaded': 0, 'failed': 0} for domain in self.shopify_clients}
         self.image_processor = ImageProcessor(config)
+        self.source_mirror: Optional[SourceMirror] = None
+        self.output_store: Optional[OutputStore] = None
+        self.cutout_store: Optional[CutoutStore] = None
+        self.upload_ledger: Optional[UploadLedger] = None
+        self.retry_queue: Optional[RetryQueue] = None
         self.errors = []
     
     def load_csv(self, csv_path: str) -> List[ImageRow]:
         """Load and parse CSV file"""
-        rows = []
-        with open(csv_path, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for i, row_data in enumerate(reader):
-                if self.config.limit and i >= self.config.limit:
-                    break
-                
-                row = ImageRow(
-                    sku=row_data.get('sku', ''),
-                    image_url=row_data.get('image_url') or None,
-                    image_path=row_data.get('image_path') or None,
-                    handle=row_data.get('handle') or None,
-                    product_id=row_data.get('product_id') or None,
-                    overlay_text=row_data.get('overlay_text') or None,
-                    overlay_logo_path=row_data.get('overlay_logo_path') or None,
-                    bg_color=row_data.get('bg_color') or None,
-                    target=int(row_data.get('target', 0)) or None,
-                    text_position=row_data.get('text_position', 'bottom-left'),
-                    watermark_img=row_data.get('watermark_img') or None,
-                    watermark_opacity=float(row_data.get('watermark_opacity', 0)) or None,
-                    replace_strategy=row_data.get('replace_strategy', 'append'),
-                    alt_text=row_data.get('alt_text') or None,
-                    is_featured=row_data.get('is_featured', '').lower() == 'true',
-                    variant_sku=row_data.get('variant_sku') or None
-                )
-                rows.append(row)
-        
-        return rows
-    
-    async def process_row(self, row: ImageRow, output_dir: Path) -> bool:
-        """Process a single row"""
+        return load_rows(csv_path, self.config.limit)
+    
+    async def process_row(self, job: RowJob) -> Optional[bool]:
+        """Process a single row; returns None when it was re-queued for a retry"""
+        row = job.row
         try:
-            logger.info(f"🔄 Processing {row.sku}")
-            
-            # Remove background
-            if row.image_url:
-                image_data = await self.remove_bg.remove_background(image_url=row.image_url)
-            elif row.image_path:
-                image_data = await self.remove_bg.remove_background(image_path=row.image_path)
+            if job.attempts:
+                logger.info(f"🔁 Retrying {row.sku} (attempt {job.attempts + 1})")
             else:
-                raise ValueError("No image source provided")
-            
-            # Process image
-            processed_data = self.image_processor.process_image(image_data, row)
-            
-            # Save processed image
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{row.sku}_{timestamp}.png"
-            output_path = output_dir / filename
-            
-            with open(output_path, 'wb') as f:
-                f.write(processed_data)
+                logger.info(f"🔄 Processing {row.sku}")
             
-            logger.info(f"✅ Saved: {output_path}")
+            if job.processed is None:
+                if job.cutout is None:
+                    # Remove background
+                    if row.image_url and self.source_mirror:
+                        if job.source is None:
+                            job.source = await self.source_mirror.fetch(row.image_url)
+                        job.cutout = await self.remove_bg.remove_background(image_data=job.source)
+                    elif row.image_url:
+                        job.cutout = await self.remove_bg.remove_background(image_url=row.image_url)
+                    elif row.image_path:
+                        job.cutout = await self.remove_bg.remove_background(image_path=row.image_path)
+                    else:
+                        raise ValueError("No image source provided")
+                    job.source = None
+                    
+                    # Crop to the alpha bounding box so later stages skip the transparent margins
+                    job.cutout = await asyncio.to_thread(compact_cutout, job.cutout)
+                    
+                    # Keep the cutout so renders can be replayed with --render-only
+                    if self.cutout_store:
+                        await self.cutout_store.save(row, job.cutout)
+                
+                # Process image
+                processed_data = self.image_processor.process_image(job.cutout, row)
+                
+                # Save processed image
+                output_path = await self.output_store.save(row.sku, processed_data)
+                job.processed, job.cutout = processed_data, None
+                
+                logger.info(f"✅ Saved: {output_path}")
             
-            # Upload to Shopify if not dry run
+            # Upload to every shop if not dry run
             if not self.config.dry_run:
-                await self._upload_to_shopify(row, processed_data, filename)
+                return await self._upload_to_shops(job)
             
             return True
             
+        except RetryableError as e:
+            if not isinstance(e, UpstreamUnavailable):
+                job.attempts += 1
+            if job.attempts < self.config.max_retries:
+                delay = retry_delay(job.attempts, e.retry_after)
+                # Paused upstreams are already reported by their circuit breaker
+                log = logger.debug if isinstance(e, UpstreamUnavailable) else logger.warning
+                log(f"⚠️ Row {row.sku}: {e}, retrying in {delay:.1f}s")
+                self.retry_queue.schedule(job, delay)
+                return None
+            if job.uploads:
+                for domain in job.pending_uploads():
+                    self._record_shop_failure(job, domain, e)
+            else:
+                self._record_error(row, e)
+            return False
+            
         except Exception as e:
-            error_msg = f"❌ Row {row.sku}: {str(e)}"
-            logger.error(error_msg)
-            self.errors.append({
-                'sku': row.sku,
-                'image_url': row.image_url,
-                'image_path': row.image_path,
-                'error': str(e),
-                'timestamp': datetime.now().isoformat()
-            })
+            self._record_error(row, e)
             return False
     
-    async def _upload_to_shopify(self, row: ImageRow, image_data: bytes, filename: str):
-        """Upload processed image to Shopify"""
-        # Resolve product ID
-        product_id = None
-        
-        if row.product_id:
-            product_id = row.product_id
-        elif row.handle:
-            product = self.shopify.get_product_by_handle(row.handle)
-            if product:
-                product_id = str(product['id'])
-        elif row.sku:
-            variant, product = self.shopify.get_variant_by_sku(row.sku)
-            if product:
-                product_id = str(product['id'])
+    def _record_error(self, row: ImageRow, error: Exception, shop: Optional[str] = None):
+        error_msg = f"❌ Row {row.sku}{f' on {shop}' if shop else ''}: {str(error)}"
+        logger.error(error_msg)
+        self.errors.append({
+            'sku': row.sku,
+            'image_url': row.image_url,
+            'image_path': row.image_path,
+            'shop': shop or '',
+            'error': str(error),
+            'timestamp': datetime.now().isoformat()
+        })
+    
+    def _record_shop_failure(self, job: RowJob, domain: str, error: Exception):
+        job.uploads[domain].error = str(error)
+        self.shop_results[domain]['failed'] += 1
+        self._record_error(job.row, error, shop=domain)
+    
+    async def _upload_to_shops(self, job: RowJob) -> bool:
+        """Upload the rendered image to every shop concurrently; only unfinished shops are retried"""
+        if not job.uploads:
+            job.uploads = {domain: ShopUpload() for domain in self.shopify_clients}
+        
+        pending = job.pending_uploads()
+        # Shopify calls use blocking requests, so each shop uploads from its own threads
+        results = await asyncio.gather(*(
+            self.shopify_clients[domain].run(self._upload_to_shopify, self.shopify_clients[domain], job, upload)
+            for domain, upload in pending.items()
+        ), return_exceptions=True)
         
+        retryable = []
+        for domain, result in zip(pending, results):
+            if isinstance(result, RetryableError):
+                retryable.append(result)
+            elif isinstance(result, BaseException):
+                self._record_shop_failure(job, domain, result)
+            else:
+                job.uploads[domain].done = True
+                self.shop_results[domain]['uploaded'] += 1
+        
+        if retryable:
+            # Prefer a real failure so the row's retry budget is charged for it
+            raise next((e for e in retryable if not isinstance(e, UpstreamUnavailable)), retryable[0])
+        
+        return all(upload.done for upload in job.uploads.values())
+    
+    def _upload_to_shopify(self, shopify: 'ShopifyClient', job: RowJob, upload: ShopUpload):
+        """Upload processed image to one shop, skipping steps finished on earlier attempts"""
+        row = job.row
+        shop = shopify.shop_domain
+        
+        # Resolve product ID; product IDs are store-specific, so with several
+        # shops only the first one trusts the CSV product_id
+        if not upload.product_id:
+            if row.product_id and shop == next(iter(self.shopify_clients)):
+                upload.product_id = row.product_id
+            elif row.handle:
+                product = shopify.get_product_by_handle(row.handle)
+                if product:
+                    upload.product_id = str(product['id'])
+            elif row.sku:
+                variant, product = shopify.get_variant_by_sku(row.sku)
+                if product:
+                    upload.product_id = str(product['id'])
+        
+        product_id = upload.product_id
         if not product_id:
             raise ValueError(f"Could not resolve product ID for SKU {row.sku}")
         
         # Handle replace strategies
-        if row.replace_strategy == "replace_all":
-            self.shopify.delete_product_images(product_id)
-            logger.info(f"🧹 Replaced images (strategy=replace_all)")
-        elif row.replace_strategy == "replace_featured":
-            product = self.shopify.get_product_by_id(product_id)
-            if product['images']:
-                featured_image_id = product['images'][0]['id']
-                self.shopify.delete_product_images(product_id, [featured_image_id])
+        if 'replace' not in upload.completed_steps:
+            if row.replace_strategy == "replace_all":
+                shopify.delete_product_images(product_id)
+                logger.info(f"🧹 Replaced images on {shop} (strategy=replace_all)")
+            elif row.replace_strategy == "replace_featured":
+                product = shopify.get_product_by_id(product_id)
+                if product['images']:
+                    featured_image_id = product['images'][0]['id']
+                    shopify.delete_product_images(product_id, [featured_image_id])
+            upload.completed_steps.add('replace')
         
         # Upload image
-        alt_text = row.alt_text or row.overlay_text or row.sku
-        image_response = self.shopify.upload_product_image(product_id, image_data, alt_text)
-        image_id = image_response['id']
-        
-        logger.info(f"⬆️ Uploaded image to product_id={product_id} (image_id={image_id})")
+        if not upload.image_id:
+            alt_text = row.alt_text or row.overlay_text or row.sku
+            image_response = shopify.upload_product_image(product_id, job.processed, alt_text)
+            upload.image_id = image_response['id']
+            # Stamp with Shopify's clock so catalog sync never mistakes this upload for a new source
+            upload.uploaded_at = image_response.get('created_at') or datetime.now(timezone.utc).isoformat()
+            self.upload_ledger.record(shop, product_id, upload.image_id, upload.uploaded_at)
+            logger.info(f"⬆️ Uploaded image to {shop} product_id={product_id} (image_id={upload.image_id})")
+        image_id = upload.image_id
         
         # Set as featured if requested
-        if row.is_featured:
-            self.shopify.set_featured_image(product_id, image_id)
-            logger.info(f"⭐ Set as featured")
+        if row.is_featured and 'featured' not in upload.completed_steps:
+            shopify.set_featured_image(product_id, image_id)
+            upload.completed_steps.add('featured')
+            logger.info(f"⭐ Set as featured on {shop}")
         
         # Assign to variant if specified
-        if row.variant_sku:
-            variant, _ = self.shopify.get_variant_by_sku(row.variant_sku)
+        if row.variant_sku and 'variant' not in upload.completed_steps:
+            variant, _ = shopify.get_variant_by_sku(row.variant_sku)
             if variant:
-                self.shopify.assign_image_to_variant(product_id, variant['id'], image_id)
-                logger.info(f"🔗 Assigned to variant sku={row.variant_sku}")
+                shopify.assign_image_to_variant(product_id, variant['id'], image_id)
+                logger.info(f"🔗 Assigned to variant sku={row.variant_sku} on {shop}")
+            upload.completed_steps.add('variant')
         
         # Add metafield for tracking
-        self.shopify.add_product_metafield(
+        shopify.add_product_metafield(
             product_id, 
             'spm_processing', 
             'last_image_pipeline_at', 
-            datetime.now().isoformat()
+            upload.uploaded_at or datetime.now(timezone.utc).isoformat()
         )
     
     async def process_bulk(self, csv_path: str, output_dir: str):
         """Process all rows in CSV"""
+        # Load CSV
+        rows = self.load_csv(csv_path)
+        logger.info(f"📊 Loaded {len(rows)} rows from CSV")
+        
+        async def csv_rows():
+            for row in rows:
+                yield row
+        
+        await self._run_pipeline(csv_rows(), output_dir)
+    
+    async def process_sync(self, output_dir: str):
+        """Process only the products whose images changed since their last pipeline run"""
+        domain, shopify = next(iter(self.shopify_clients.items()))
+        logger.info(f"🔎 Syncing catalog from {domain}")
+        
+        catalog = CatalogSync(shopify, self.config, Path(output_dir))
+        await self._run_pipeline(catalog.iter_rows(), output_dir)
+    
+    async def _run_pipeline(self, rows: AsyncIterator[ImageRow], output_dir: str):
+        """Feed rows through the worker pool as they arrive, then report"""
         # Create output directory
         output_path = Path(output_dir)
         output_path.mkdir(exist_ok=True)
         
-        # Load CSV
-        rows = self.load_csv(csv_path)
-        logger.info(f"📊 Loaded {len(rows)} rows from CSV")
+        # Mirror source images locally so reruns only revalidate
+        if self.config.mirror_sources:
+            cache_dir = Path(self.config.source_cache_dir) if self.config.source_cache_dir else output_path / 'sources'
+            self.source_mirror = SourceMirror(cache_dir, self.config.per_host_concurrency)
+        
+        self.output_store = OutputStore(output_path, self.config.archive_path)
+        self.upload_ledger = UploadLedger(output_path)
+        if self.config.save_cutouts:
+            self.cutout_store = CutoutStore(Path(self.config.cutout_dir) if self.config.cutout_dir else output_path / 'cutouts')
+        
+        # Workers pull from the ready queue; rows waiting to retry sit in the
+        # retry queue so they never hold one of the concurrency slots
+        ready = asyncio.Queue()
+        self.retry_queue = RetryQueue(ready)
+        
+        results = []
+        all_done = asyncio.Event()
+        feed = {'total': 0, 'finished': False, 'error': None}
         
-        # Process with concurrency control
-        semaphore = asyncio.Semaphore(self.config.default_concurrency)
+        def check_done():
+            if feed['finished'] and len(results) == feed['total']:
+                all_done.set()
         
-        async def process_with_semaphore(row):
-            async with semaphore:
-                return await self.process_row(row, output_path)
+        async def producer():
+            try:
+                async for row in rows:
+                    feed['total'] += 1
+                    ready.put_nowait(RowJob(row))
+            except Exception as e:
+                # Let queued rows finish, then surface the error
+                feed['error'] = e
+            feed['finished'] = True
+            check_done()
+        
+        async def worker():
+            while True:
+                job = await ready.get()
+                result = await self.process_row(job)
+                if result is not None:
+                    results.append(result)
+                    check_done()
         
         # Process all rows
-        tasks = [process_with_semaphore(row) for row in rows]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        tasks = [asyncio.create_task(worker()) for _ in range(self.config.default_concurrency)]
+        tasks.append(asyncio.create_task(self.retry_queue.run()))
+        tasks.append(asyncio.create_task(producer()))
+        try:
+            await all_done.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self.source_mirror:
+                await self.source_mirror.close()
+            await self.output_store.close()
+            for shopify in self.shopify_clients.values():
+                shopify.close()
+        
+        if self.source_mirror:
+            stats = self.source_mirror.stats
+            logger.info(f"🪞 Source mirror: {stats['downloaded']} downloaded, "
+                        f"{stats['not_modified']} not modified, {stats['stale']} stale")
+        
+        stats = self.output_store.stats
+        logger.info(f"💾 Output store: {stats['written']} written, {stats['deduplicated']} deduplicated")
         
         # Log results
         successful = sum(1 for r in results if r is True)
@@ -600,19 +1660,159 @@ class BulkImageProcessor:
         
         logger.info(f"🎉 Processing complete: {successful} successful, {failed} failed")
         
+        if not self.config.dry_run and len(self.shop_results) > 1:
+            for domain, counts in self.shop_results.items():
+                logger.info(f"🏬 {domain}: {counts['uploaded']} uploaded, {counts['failed']} failed")
+        
         # Save error log
         if self.errors:
             error_path = output_path / 'errors.csv'
             with open(error_path, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=['sku', 'image_url', 'image_path', 'error', 'timestamp'])
+                writer = csv.DictWriter(f, fieldnames=['sku', 'image_url', 'image_path', 'shop', 'error', 'timestamp'])
                 writer.writeheader()
                 writer.writerows(self.errors)
             logger.info(f"📝 Error log saved: {error_path}")
+        
+        if feed['error']:
+            raise feed['error']
+
+class RenderReplay:
+    """Replays saved cutouts through ImageProcessor without touching the network"""
+
+    def __init__(self, config: ProcessingConfig, cutout_dir: str, profile_dir: Optional[str] = None,
+                 trace_memory: bool = False, golden_path: Optional[str] = None, update_golden: bool = False):
+        self.config = config
+        self.cutouts = CutoutStore(Path(cutout_dir))
+        self.image_processor = ImageProcessor(config)
+        self.profile_dir = Path(profile_dir) if profile_dir else None
+        if self.profile_dir:
+            self.image_processor.profiler = StageProfiler()
+        self.trace_memory = trace_memory
+        self.golden_path = Path(golden_path) if golden_path else None
+        self.update_golden = update_golden
+
+    async def run(self, csv_path: Optional[str], output_dir: str) -> bool:
+        """Render every row from saved cutouts; returns False on failures or golden mismatches"""
+        # Experimental renders never go into the production manifest or hand-off archive
+        output_path = Path(output_dir)
+        output_path.mkdir(parents=True, exist_ok=True)
+        output_store = OutputStore(output_path)
+
+        if csv_path:
+            rows = load_rows(csv_path, self.config.limit)
+        else:
+            rows = self.cutouts.rows_from_directory(self.config.limit)
+        logger.info(f"🎬 Replaying {len(rows)} renders from {self.cutouts.cutout_dir}")
+
+        if self.trace_memory:
+            tracemalloc.start()
+            baseline = tracemalloc.take_snapshot()
+
+        checksums = {}
+        rendered = failed = 0
+        started = time.perf_counter()
+        for row in rows:
+            cutout_path = self.cutouts.find(row)
+            if not cutout_path:
+                logger.error(f"❌ Row {row.sku}: no saved cutout in {self.cutouts.cutout_dir}")
+                failed += 1
+                continue
+            try:
+                cutout_data = await asyncio.to_thread(cutout_path.read_bytes)
+                processed_data = self.image_processor.process_image(cutout_data, row)
+            except Exception as e:
+                logger.error(f"❌ Row {row.sku}: {str(e)}")
+                failed += 1
+                continue
+            await output_store.save(row.sku, processed_data)
+            checksums[self._golden_key(cutout_path, row)] = hashlib.sha256(processed_data).hexdigest()
+            rendered += 1
+        elapsed = time.perf_counter() - started
+        await output_store.close()
+
+        logger.info(f"🎉 Rendered {rendered} images in {elapsed:.2f}s, {failed} failed")
+
+        if self.image_processor.profiler:
+            self.image_processor.profiler.log_summary()
+            self.image_processor.profiler.dump(self.profile_dir)
+
+        if self.trace_memory:
+            self._report_memory(baseline, output_path)
+
+        mismatches = self._check_golden(checksums) if self.golden_path else 0
+        return failed == 0 and mismatches == 0
+
+    @staticmethod
+    def _golden_key(cutout_path: Path, row: ImageRow) -> str:
+        """Cutout name plus the row's render options, so rows sharing a cutout keep separate checksums"""
+        options = {
+            'target': row.target,
+            'bg_color': row.bg_color,
+            'overlay_text': row.overlay_text,
+            'overlay_logo_path': row.overlay_logo_path,
+            'text_position': row.text_position if row.overlay_text else None,
+            'watermark_img': row.watermark_img,
+            'watermark_opacity': row.watermark_opacity,
+        }
+        options = {name: value for name, value in options.items() if value is not None}
+        if not options:
+            return cutout_path.stem
+        digest = hashlib.sha256(json.dumps(options, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+        return f"{cutout_path.stem}@{digest}"
+
+    def _report_memory(self, baseline: tracemalloc.Snapshot, output_path: Path):
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        snapshot_path = output_path / 'tracemalloc.snapshot'
+        snapshot.dump(str(snapshot_path))
+        logger.info(f"🧠 Peak traced memory: {peak / 1024 / 1024:.1f} MiB (snapshot: {snapshot_path})")
+        # Leave out the profilers' own bookkeeping (cProfile runs alongside with --profile)
+        # and modules imported lazily during the first render
+        ignore = [
+            tracemalloc.Filter(False, cProfile.__file__),
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+        ]
+        growth = snapshot.filter_traces(ignore).compare_to(baseline.filter_traces(ignore), 'lineno')
+        for stat in growth[:10]:
+            logger.info(f"🧠 {stat}")
+
+    def _check_golden(self, checksums: Dict[str, str]) -> int:
+        """Compare render checksums with the golden file, recording it if missing"""
+        if self.update_golden or not self.golden_path.exists():
+            golden = {}
+            if self.golden_path.exists():
+                with open(self.golden_path, 'r', encoding='utf-8') as f:
+                    golden = json.load(f)
+            golden.update(checksums)
+            atomic_write(self.golden_path, json.dumps(golden, indent=2, sort_keys=True).encode('utf-8'))
+            logger.info(f"🏅 Golden checksums recorded: {self.golden_path} ({len(checksums)} renders)")
+            return 0
+
+        with open(self.golden_path, 'r', encoding='utf-8') as f:
+            golden = json.load(f)
+
+        mismatches = 0
+        for key, digest in checksums.items():
+            expected = golden.get(key)
+            if expected is None:
+                logger.warning(f"⚠️ No golden checksum for {key}")
+            elif expected != digest:
+                logger.error(f"❌ Golden mismatch for {key}: expected {expected[:12]}, got {digest[:12]}")
+                mismatches += 1
+
+        if mismatches:
+            logger.error(f"❌ {mismatches} renders differ from {self.golden_path}")
+        else:
+            logger.info(f"🏅 All renders match {self.golden_path}")
+        return mismatches
 
 def main():
     """Main entry point"""
     parser = argparse.ArgumentParser(description='Shopify Bulk Image Pipeline')
-    parser.add_argument('--input', required=True, help='Input CSV file path')
+    parser.add_argument('--input', help='Input CSV file path')
     parser.add_argument('--outdir', default='out', help='Output directory')
     parser.add_argument('--target', type=int, default=2048, help='Target canvas size')
     parser.add_argument('--bg-color', default='#FFFFFF', help='Background color')
@@ -623,9 +1823,38 @@ def main():
     parser.add_argument('--watermark-text', help='Text watermark')
     parser.add_argument('--watermark-opacity', type=float, default=0.12, help='Watermark opacity')
     parser.add_argument('--watermark-scale', type=float, default=0.35, help='Watermark scale')
+    parser.add_argument('--source-cache', help='Source image mirror directory (default: <outdir>/sources)')
+    parser.add_argument('--no-source-mirror', action='store_true', help='Pass image URLs straight to Remove.bg')
+    parser.add_argument('--archive', help='Also stream outputs into a .zip, .tar or .tar.gz archive')
+    parser.add_argument('--per-host-concurrency', type=int, default=4, help='Concurrent source downloads per host')
+    parser.add_argument('--cutouts', help='Saved cutout directory (default: <outdir>/cutouts)')
+    parser.add_argument('--no-save-cutouts', action='store_true', help='Do not keep Remove.bg cutouts')
+    parser.add_argument('--shopify-rps', type=float, default=2.0, help='Shopify REST requests per second, per shop')
+    parser.add_argument('--sync', action='store_true', help='Read work from the Shopify catalog instead of a CSV')
+    parser.add_argument('--sync-since', help='Sync: only scan products updated after this ISO timestamp')
+    parser.add_argument('--sync-bulk', action='store_true', help='Sync: scan with a GraphQL bulk operation (large catalogs)')
+    parser.add_argument('--sync-replace-strategy', default='append',
+                        choices=['append', 'replace_featured', 'replace_all'], help='Sync: replace strategy for synced products')
+    parser.add_argument('--render-only', action='store_true', help='Replay saved cutouts through rendering only')
+    parser.add_argument('--replay-outdir', help='Render-only: where replayed renders go (default: <outdir>/replay)')
+    parser.add_argument('--profile', metavar='DIR', help='Render-only: dump per-stage cProfile stats to DIR')
+    parser.add_argument('--tracemalloc', action='store_true', help='Render-only: report tracemalloc snapshots')
+    parser.add_argument('--golden', help='Render-only: golden checksum file (recorded if missing)')
+    parser.add_argument('--update-golden', action='store_true', help='Render-only: overwrite golden checksums')
     
     args = parser.parse_args()
     
+    if not args.input and not (args.render_only or args.sync):
+        parser.error('--input is required unless --render-only or --sync is set')
+    
+    # Several stores: SHOP_DOMAINS and SHOP_ADMIN_TOKENS as matching comma-separated lists
+    shop_domains = [d.strip() for d in os.getenv('SHOP_DOMAINS', '').split(',') if d.strip()]
+    shop_tokens = [t.strip() for t in os.getenv('SHOP_ADMIN_TOKENS', '').split(',') if t.strip()]
+    if shop_domains and len(shop_domains) != len(shop_tokens) and not args.render_only:
+        logger.error("❌ SHOP_DOMAINS and SHOP_ADMIN_TOKENS must list the same number of entries")
+        sys.exit(1)
+    shops = [ShopTarget(shop_domain=d, shop_admin_token=t) for d, t in zip(shop_domains, shop_tokens)]
+    
     # Load configuration
     config = ProcessingConfig(
         remove_bg_api_key=os.getenv('REMOVE_BG_API_KEY'),
@@ -642,27 +1871,59 @@ def main():
         watermark_text=args.watermark_text,
         watermark_img_path=args.watermark_img,
         watermark_opacity=args.watermark_opacity,
-        watermark_scale=args.watermark_scale
+        watermark_scale=args.watermark_scale,
+        mirror_sources=not args.no_source_mirror,
+        source_cache_dir=args.source_cache,
+        per_host_concurrency=args.per_host_concurrency,
+        archive_path=args.archive,
+        save_cutouts=not args.no_save_cutouts,
+        cutout_dir=args.cutouts,
+        shops=shops,
+        shopify_requests_per_second=args.shopify_rps,
+        sync_since=args.sync_since,
+        sync_bulk=args.sync_bulk,
+        sync_replace_strategy=args.sync_replace_strategy
     )
     
+    # Render-only replay needs no API credentials
+    if args.render_only:
+        replay = RenderReplay(
+            config,
+            args.cutouts or str(Path(args.outdir) / 'cutouts'),
+            profile_dir=args.profile,
+            trace_memory=args.tracemalloc,
+            golden_path=args.golden,
+            update_golden=args.update_golden
+        )
+        try:
+            ok = asyncio.run(replay.run(args.input, args.replay_outdir or str(Path(args.outdir) / 'replay')))
+        except KeyboardInterrupt:
+            logger.info("🛑 Processing interrupted by user")
+            return
+        sys.exit(0 if ok else 1)
+    
     # Validate configuration
     if not config.remove_bg_api_key:
         logger.error("❌ REMOVE_BG_API_KEY is required")
         sys.exit(1)
     
-    if not config.shop_domain:
-        logger.error("❌ SHOP_DOMAIN is required")
-        sys.exit(1)
-    
-    if not config.shop_admin_token and not (config.shopify_api_key and config.shopify_password):
-        logger.error("❌ Either SHOP_ADMIN_TOKEN or SHOPIFY_API_KEY/PASSWORD is required")
-        sys.exit(1)
+    if not config.shops:
+        if not config.shop_domain:
+            logger.error("❌ SHOP_DOMAIN (or SHOP_DOMAINS) is required")
+            sys.exit(1)
+        
+        if not config.shop_admin_token and not (config.shopify_api_key and config.shopify_password):
+            logger.error("❌ Either SHOP_ADMIN_TOKEN or SHOPIFY_API_KEY/PASSWORD is required")
+            sys.exit(1)
     
     # Create processor and run
     processor = BulkImageProcessor(config)
     
     try:
-        asyncio.run(processor.process_bulk(args.input, args.outdir))
+        if args.sync:
+            asyncio.run(processor.process_sync(args.outdir))
+        else:
+            asyncio.run(processor.process_bulk(args.input, args.outdir))
     except KeyboardInterrupt:
         logger.info("🛑 Processing interrupted by user")
     except Exception as e:
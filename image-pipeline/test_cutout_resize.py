@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Regression tests: rendering a compact cutout must match the full-frame render
+"""
+
+import io
+import random
+
+import pytest
+from PIL import Image, ImageChops, ImageDraw
+
+from process_images import ImageProcessor, ImageRow, ProcessingConfig, compact_cutout
+
+# (frame width, frame height, target): downscales, upscales, coprime sizes, no-op scale
+SIZES = [
+    (1600, 1600, 1200),
+    (300, 420, 1200),
+    (1200, 900, 1024),
+    (1201, 1199, 1024),
+    (333, 777, 600),
+    (640, 480, 640),
+]
+
+def make_cutout(width: int, height: int, seed: int, touch_edge: bool = False) -> bytes:
+    """Noisy foreground shapes with soft and hard alpha on a transparent frame"""
+    rng = random.Random(seed)
+    mask = Image.new('L', (width, height), 0)
+    draw = ImageDraw.Draw(mask)
+    for _ in range(5):
+        x0 = rng.randint(width // 5, width // 2)
+        y0 = rng.randint(height // 5, height // 2)
+        x1 = x0 + rng.randint(width // 10, width // 3)
+        y1 = y0 + rng.randint(height // 10, height // 3)
+        draw.ellipse([x0, y0, x1, y1], fill=rng.choice([255, 255, 180]))
+    if touch_edge:
+        draw.rectangle([0, height // 3, width // 8, height // 2], fill=255)
+    image = Image.frombytes('RGB', (width, height), rng.randbytes(width * height * 3)).convert('RGBA')
+    image.putalpha(mask)
+    output = io.BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
+
+def full_frame_render(image_data: bytes, target: int) -> Image.Image:
+    """Reference: the original resize of the whole frame, centered on the canvas"""
+    image = Image.open(io.BytesIO(image_data)).convert('RGBA')
+    scale = min(target / image.width, target / image.height)
+    new_size = (int(image.width * scale), int(image.height * scale))
+    image = image.resize(new_size, Image.Resampling.LANCZOS)
+    canvas = Image.new('RGBA', (target, target), '#FFFFFF')
+    canvas.paste(image, ((target - new_size[0]) // 2, (target - new_size[1]) // 2), image)
+    return canvas
+
+@pytest.mark.parametrize('width,height,target', SIZES)
+@pytest.mark.parametrize('touch_edge', [False, True])
+def test_compact_render_matches_full_frame(width, height, target, touch_edge):
+    image_data = make_cutout(width, height, seed=width * height, touch_edge=touch_edge)
+    processor = ImageProcessor(ProcessingConfig(remove_bg_api_key='', shop_domain=''))
+
+    rendered = processor.process_image(compact_cutout(image_data), ImageRow(sku='TEST', target=target))
+
+    reference = full_frame_render(image_data, target)
+    difference = ImageChops.difference(Image.open(io.BytesIO(rendered)).convert('RGBA'), reference)
+    max_difference = max(high for _, high in difference.getextrema())
+    assert max_difference == 0
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the retry machinery: circuit breaker, retry queue and backoff
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+import process_images
+from process_images import CircuitBreaker, RetryQueue, UpstreamUnavailable, retry_delay
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(process_images.time, 'monotonic', fake)
+    return fake
+
+def open_breaker(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        assert breaker.before_request() is False
+        breaker.record_failure()
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker('test', failure_threshold=3, cooldown=30.0)
+    for _ in range(2):
+        breaker.before_request()
+        breaker.record_failure()
+    assert breaker.state == 'closed'
+
+    breaker.before_request()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    with pytest.raises(UpstreamUnavailable) as excinfo:
+        breaker.before_request()
+    assert excinfo.value.retry_after == pytest.approx(30.0)
+
+def test_success_resets_failure_count(clock):
+    breaker = CircuitBreaker('test', failure_threshold=3)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+    assert breaker.failures == 1
+
+def test_breaker_probes_then_closes(clock):
+    breaker = CircuitBreaker('test', failure_threshold=2, cooldown=30.0)
+    open_breaker(breaker)
+
+    clock.now += 30.0
+    assert breaker.before_request() is True
+    assert breaker.state == 'half_open'
+    with pytest.raises(UpstreamUnavailable):
+        breaker.before_request()
+
+    breaker.record_success()
+    breaker.release_probe()
+    assert breaker.state == 'closed'
+    assert breaker.before_request() is False
+
+def test_probe_failure_reopens_with_doubled_cooldown(clock):
+    breaker = CircuitBreaker('test', failure_threshold=2, cooldown=30.0, max_cooldown=100.0)
+    open_breaker(breaker)
+
+    for expected_cooldown in (60.0, 100.0, 100.0):
+        clock.now += 1000.0
+        assert breaker.before_request() is True
+        breaker.record_failure()
+        breaker.release_probe()
+        assert breaker.state == 'open'
+        with pytest.raises(UpstreamUnavailable) as excinfo:
+            breaker.before_request()
+        assert excinfo.value.retry_after == pytest.approx(expected_cooldown)
+
+    # A successful probe restores the base cooldown for the next opening
+    clock.now += 1000.0
+    assert breaker.before_request() is True
+    breaker.record_success()
+    breaker.release_probe()
+    open_breaker(breaker)
+    with pytest.raises(UpstreamUnavailable) as excinfo:
+        breaker.before_request()
+    assert excinfo.value.retry_after == pytest.approx(30.0)
+
+def test_release_probe_frees_slot_without_outcome(clock):
+    breaker = CircuitBreaker('test', failure_threshold=1, cooldown=5.0)
+    open_breaker(breaker)
+    clock.now += 5.0
+    assert breaker.before_request() is True
+    breaker.release_probe()
+    assert breaker.state == 'half_open'
+    assert breaker.before_request() is True
+
+def test_only_one_probe_across_threads(clock):
+    breaker = CircuitBreaker('test', failure_threshold=1, cooldown=5.0)
+    open_breaker(breaker)
+    clock.now += 5.0
+
+    barrier = threading.Barrier(16)
+    results = []
+
+    def attempt():
+        barrier.wait()
+        try:
+            results.append(breaker.before_request())
+        except UpstreamUnavailable:
+            results.append(None)
+
+    threads = [threading.Thread(target=attempt) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(True) == 1
+    assert results.count(None) == 15
+
+def test_pause_holds_dispatch_without_opening(clock):
+    breaker = CircuitBreaker('test')
+    breaker.pause(10.0)
+    with pytest.raises(UpstreamUnavailable) as excinfo:
+        breaker.before_request()
+    assert excinfo.value.retry_after == pytest.approx(10.0)
+    assert breaker.state == 'closed'
+
+    clock.now += 10.0
+    assert breaker.before_request() is False
+
+def test_retry_delay_honours_retry_after():
+    for _ in range(100):
+        assert 20.0 <= retry_delay(1, retry_after=20.0) <= 23.0
+        assert 2.5 <= retry_delay(1) <= 5.0
+        assert 150.0 <= retry_delay(10) <= 300.0
+
+def test_retry_queue_releases_jobs_in_deadline_order():
+    async def scenario():
+        ready = asyncio.Queue()
+        retry_queue = RetryQueue(ready)
+        pump = asyncio.create_task(retry_queue.run())
+        try:
+            retry_queue.schedule('late', 0.15)
+            retry_queue.schedule('early', 0.05)
+            await asyncio.sleep(0.02)
+            assert ready.empty()
+            assert len(retry_queue) == 2
+
+            first = await asyncio.wait_for(ready.get(), 1.0)
+            second = await asyncio.wait_for(ready.get(), 1.0)
+            return first, second, len(retry_queue)
+        finally:
+            pump.cancel()
+
+    assert asyncio.run(scenario()) == ('early', 'late', 0)